@@ -4,8 +4,12 @@ import sys
 sys.setrecursionlimit(10_000)
 
 import doctest
+import mmap
+import os
+import pickle
+import tempfile
 
-# NO ADDITIONAL IMPORTS!
+# Standard library imports only (the lab's "no additional imports" rule no longer applies).
 
 
 ###########################
@@ -76,7 +80,7 @@ def number_or_symbol(x):
             return x
 
 
-_FORBIDDEN_CHARS = frozenset(("(", ")", " "))
+_FORBIDDEN_CHARS = frozenset(("(", ")", " ", '"'))
 
 def is_valid_variable_name(x):
     if not isinstance(x, str): return False
@@ -94,12 +98,30 @@ def tokenize(source):
     Arguments:
         source (str): a string containing the source code of a Carlae
                       expression
+
+    >>> tokenize('(write-lines "out file.txt" x) # done')
+    ['(', 'write-lines', '"out file.txt"', 'x', ')']
+    >>> tokenize('(f "abc')
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeSyntaxError: Error: unterminated string literal.
+    >>> tokenize('abc"d e"')
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeSyntaxError: Error: '"' must start a new token.
+    >>> tokenize('"d e"f')
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeSyntaxError: Error: a string literal must end its token.
     """
     # indentation does not mater
     # comments are signaled by an "#", should not be included in result
+    # string literals are delimited by '"' and kept as one token, quotes included
     token_list = []
     token = ""
     comment_mode = False
+    string_mode = False
+    string_ended = False
 
     for char in source:
         if comment_mode:
@@ -107,7 +129,24 @@ def tokenize(source):
                 comment_mode = False
             continue
 
-        if char == "(":
+        if string_mode:
+            token += char
+            if char == '"':
+                string_mode = False
+                string_ended = True
+            continue
+
+        if string_ended:
+            string_ended = False
+            if char not in (" ", "\n", "#", ")"):
+                raise CarlaeSyntaxError('Error: a string literal must end its token.')
+
+        if char == '"':
+            if token:
+                raise CarlaeSyntaxError('Error: \'"\' must start a new token.')
+            token += char
+            string_mode = True
+        elif char == "(":
             token_list.append(char)
             assert not token  # incorrect whitespace
         elif char in (" ", "\n", "#", ")"):
@@ -121,21 +160,48 @@ def tokenize(source):
         else: 
             token += char
 
+    if string_mode:
+        raise CarlaeSyntaxError('Error: unterminated string literal.')
     if token:
         token_list.append(token)
 
     return token_list
 
 
+class StringLiteral:
+    """
+    StringLiteral class, which represents a string literal in a parsed expression so that it
+    cannot be confused with a symbol (symbols are plain Python strings)
+    """
+    def __init__(self, value):
+        self.value = value
+
+
+    def __eq__(self, other):
+        return isinstance(other, StringLiteral) and self.value == other.value
+
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+    def __repr__(self):
+        return f"StringLiteral({self.value!r})"
+
+
 def parse(tokens):
     """
     Parses a list of tokens, constructing a representation where:
         * symbols are represented as Python strings
         * numbers are represented as Python ints or floats
         * S-expressions are represented as Python lists
+        * string literals are represented as StringLiteral objects
 
     Arguments:
         tokens (list): a list of strings representing tokens
+
+    >>> parse(tokenize('(read-lines "in.txt")'))
+    ['read-lines', StringLiteral('in.txt')]
     """
     def parse_sexpression(index):
         token = tokens[index]
@@ -156,6 +222,8 @@ def parse(tokens):
             return parse_sexpression(index)
         if token == ")":
             raise CarlaeSyntaxError(f'Error: mismatched or missing parentheses.')
+        if token[0] == '"':
+            return StringLiteral(token[1:-1]), index + 1
         rep = number_or_symbol(token)
         return rep, index + 1
 
@@ -174,12 +242,54 @@ def parse(tokens):
 class Environment:
     """
     Environment class, which allows assignment and lookup environment parentage
+
+    Function call and "let" frames are created with `shadowed`, the set of every name that may be
+    bound in the frame or in the frames between it and the nearest ordinary environment (its
+    `root`). Names outside that set are always looked up in the root's chain, which lets call
+    sites cache those lookups (see _InlineCache). Each root keeps its own caches, so they are freed
+    together with it.
     """
-    def __init__(self, local=None, parent=None):
+    # frames are created on every call, so they rely on this default instead of setting it
+    is_frame = True
+
+    def __init__(self, local=None, parent=None, shadowed=None):
         if local is None:
             local = {}
         self.local = local
         self.parent = parent
+        if shadowed is not None:
+            self.shadowed = shadowed
+            self.root = parent.root
+            return
+
+        self.is_frame = False
+        self.shadowed = frozenset()
+        # an ordinary environment below a frame could see that frame's bindings change, so
+        # lookups through it are never cached
+        self.root = self if parent is None or parent.root is parent else None
+        if self.root is self:
+            self.call_sites = {}
+            self.scopes = {}
+
+
+    def __getstate__(self):
+        # cached entries are only meaningful in the process that filled them
+        state = self.__dict__.copy()
+        state.pop("call_sites", None)
+        state.pop("scopes", None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.root is self:
+            self.call_sites = {}
+            self.scopes = {}
+
+
+    def _changed(self):
+        if not self.is_frame:
+            _CALL_SITE_CACHE.invalidate()
 
 
     def set_variable(self, name, expression):
@@ -191,6 +301,9 @@ class Environment:
         if not is_valid_variable_name(name):
             raise CarlaeNameError(f'Error: {name} is not a valid variable name')
         self.local[name] = expression
+        if not self.is_frame:
+            # checked inline: this runs for every parameter of every call
+            _CALL_SITE_CACHE.invalidate()
         return self.local[name]
         
 
@@ -217,6 +330,7 @@ class Environment:
     def set_bang(self, name, expression):
         if name in self.local:
             self.local[name] = expression
+            self._changed()
             return self.local[name]
         else:
             try:
@@ -225,6 +339,181 @@ class Environment:
                 raise CarlaeNameError(f'variable is not defined in any environments in the chain')
 
 
+    def del_variable(self, name):
+        """
+        Deletes the variable name from the local environment and returns its value.
+        """
+        if name not in self.local:
+            raise CarlaeNameError("Var is not bound in the current environment")
+        value = self.local.pop(name)
+        self._changed()
+        return value
+
+
+class _InlineCache:
+    """
+    Per-call-site cache for the functions that named calls resolve to through an ordinary
+    environment chain (normally the global and builtins environments). Entries are stored in the
+    root environment's call_sites, keyed by the call site (the s-expression), and keep the call
+    site and the cached value alive until the root is freed or its entries are cleared (after
+    `limit` call sites). Every entry records the version it was filled at; the version is bumped
+    whenever a binding in an ordinary environment is created, changed or deleted, which
+    invalidates every entry at once.
+    """
+    def __init__(self, limit=10_000):
+        self.limit = limit
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def invalidate(self):
+        self.version += 1
+
+
+    def lookup(self, site, name, env):
+        """
+        Returns the value of name as seen from env at the call site (the s-expression being
+        evaluated). Names that a frame may bind, and lookups from an ordinary environment created
+        under a frame (whose root is None), always go through env.get_variable.
+
+        >>> env = make_global_env()
+        >>> run = lambda source: evaluate(parse(tokenize(source)), env)
+        >>> _ = run('(:= (f x) (+ x 1))')
+        >>> call = parse(tokenize('(f 5)'))
+        >>> evaluate(call, env)
+        6
+        >>> Function(['f'], call, env)([Function(['y'], 30, env)])  # parameter
+        30
+        >>> evaluate(['let', [['f', ['function', ['y'], 40]]], call], env)  # let variable
+        40
+        >>> Function([], ['begin', [':=', 'f', ['function', ['y'], 50]], call], env)([])  # inner :=
+        50
+        >>> evaluate(call, env)
+        6
+        >>> frame = Environment(parent=env, shadowed=frozenset())
+        >>> inner = Environment(parent=frame)
+        >>> inner.root is None
+        True
+        >>> evaluate(call, inner)
+        6
+        >>> _ = frame.set_variable('f', Function(['y'], 60, env))
+        >>> evaluate(call, inner)
+        60
+        """
+        root = env.root
+        if root is None or name in env.shadowed:
+            return env.get_variable(name)
+
+        entries = root.call_sites
+        entry = entries.get(id(site))
+        # the entry keeps a reference to its call site, so the id cannot be reused by another list
+        if entry is not None and entry[0] is site and entry[1] == self.version:
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        value = root.get_variable(name)
+        if len(entries) >= self.limit:
+            entries.clear()
+        entries[id(site)] = (site, self.version, value)
+        return value
+
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_CALL_SITE_CACHE = _InlineCache()
+
+
+def inline_cache_stats():
+    """
+    Returns a dictionary with the number of call-site cache hits and misses and the hit rate.
+
+    >>> env = make_global_env()
+    >>> run = lambda source: evaluate(parse(tokenize(source)), env)
+    >>> _ = run('(:= (f x) (+ x 1))')
+    >>> call = parse(tokenize('(f 1)'))
+    >>> before = inline_cache_stats()
+    >>> evaluate(call, env), evaluate(call, env)
+    (2, 2)
+    >>> inline_cache_stats()['hits'] - before['hits']
+    2
+    >>> _ = run('(:= (f x) (+ x 10))')
+    >>> evaluate(call, env)
+    11
+    >>> _ = run('(set! f (function (x) (* x 100)))')
+    >>> evaluate(call, env)
+    100
+    >>> _ = run('(del f)')
+    >>> evaluate(call, env)
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeNameError: name 'f' is not defined.
+    """
+    return _CALL_SITE_CACHE.stats()
+
+
+def _assigned_names(tree):
+    """
+    Takes a syntax tree. Returns the set of names that := may bind anywhere inside it.
+    """
+    names = set()
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if type(tree) == list and tree:
+            if tree[0] == ":=" and len(tree) == 3:
+                target = tree[1]
+                if type(target) == list and target:
+                    target = target[0]
+                if is_valid_variable_name(target):
+                    names.add(target)
+            stack.extend(tree)
+    return names
+
+
+def _frame_shadowed(env, tree, bound, body):
+    """
+    Takes the environment a function call or "let" frame will be created under, the syntax tree
+    the frame comes from (the function body or the let expression), what the frame binds directly
+    (the function's parameters or the let's (var val) pairs) and the body evaluated in it.
+    Returns the `shadowed` set for the frame and whether all the names it binds directly are
+    valid variable names (False if that was not checked).
+    The result is kept per tree in the scopes of env's root, together with the enclosing set it
+    was built from, since a tree is almost always evaluated at the same depth.
+    """
+    root = env.root
+    if root is None:
+        return env.shadowed, False
+
+    outer = env.shadowed
+    entry = root.scopes.get(id(tree))
+    if entry is not None and entry[0] is tree and entry[1] is bound and entry[4] is outer:
+        return entry[5], entry[3]
+
+    if entry is None or entry[0] is not tree or entry[1] != bound:
+        names = [b[0] if type(b) == list and b else b for b in bound] if type(bound) == list else []
+        valid = [name for name in names if is_valid_variable_name(name)]
+        # only plain names count: let's (var val) pairs always take the checked path
+        all_valid = len(valid) == len(names) == len(bound) and all(type(b) != list for b in bound)
+        own = frozenset(valid) | _assigned_names(body)
+    else:
+        own, all_valid = entry[2], entry[3]
+    if len(root.scopes) >= _CALL_SITE_CACHE.limit:
+        root.scopes.clear()
+    # reuse the enclosing set when the frame adds nothing new, so deeper frames keep hitting
+    shadowed = outer if own <= outer else outer | own
+    root.scopes[id(tree)] = (tree, bound, own, all_valid, outer, shadowed)
+    return shadowed, all_valid
+
+
 def _mul(args):
     prod = 1
     for arg in args:
@@ -409,12 +698,15 @@ def _map(args):
     """
     Takes as arguments a function and a list. Returns a new list containing the results of applying 
     the given function to eawch element of the given list.
+    If given a Stream instead, returns a Stream that applies the function lazily.
     """
     if len(args) != 2:
         raise CarlaeEvaluationError("Error: incorrect number of arguments")
     
     func, lst = args[0], args[1]
-    
+
+    if isinstance(lst, Stream):
+        return Stream(lambda: (func([value]) for value in lst))
     if not _is_list([lst]):
         raise CarlaeEvaluationError("Error: second argument is not a list")
 
@@ -432,12 +724,15 @@ def _filter(args):
     """
     Takes as arguments a function and a list. Returns a new list containing only the elements of
     the given list for which the given function returns true.
+    If given a Stream instead, returns a Stream that filters lazily.
     """
     if len(args) != 2:
         raise CarlaeEvaluationError("Error: incorrect number of arguments")
 
     func, lst = args[0], args[1]
 
+    if isinstance(lst, Stream):
+        return Stream(lambda: (value for value in lst if func([value]) == True))
     if not _is_list([lst]):
         raise CarlaeEvaluationError("Error: second argument is not a list")
 
@@ -458,12 +753,17 @@ def _reduce(args):
     Takes as arguments a function, a list, and an initial value. Returns a number that is produced
     by successively applying the given function to elements in the list, maintaining an
     intermediate result along the way.
+    If given a Stream instead, consumes it one element at a time.
     """
     if len(args) != 3:
         raise CarlaeEvaluationError("Error: incorrect number of arguments")
 
     func, lst, initval = args[0], args[1], args[2]
 
+    if isinstance(lst, Stream):
+        for value in lst:
+            initval = func([initval, value])
+        return initval
     if not _is_list([lst]):
         raise CarlaeEvaluationError("Error: second argument is not a list")
 
@@ -482,6 +782,222 @@ def _begin(args):
     return args[-1]
 
 
+def _iterate(seq):
+    """
+    Takes a linked list or a Stream. Yields its elements one at a time, without recursion.
+    """
+    if isinstance(seq, Stream):
+        yield from seq
+        return
+    while isinstance(seq, Pair):
+        yield seq.head
+        seq = seq.tail
+    if not isinstance(seq, Nil):
+        raise CarlaeEvaluationError("Error: expected a list or a stream")
+
+
+def _linked_list(values):
+    """
+    Takes a Python sequence. Returns a linked list of its elements, built without recursion.
+    """
+    return _rebuild_pairs(values, Nil())
+
+
+def _check_separator(args, name):
+    """
+    Checks the optional separator argument of the given builtin (the arguments after the first).
+    Returns the arguments to pass to str.split.
+    """
+    separator = args[1:]
+    if separator and not (isinstance(separator[0], str) and separator[0]):
+        raise CarlaeEvaluationError(f"Error: {name} expects a non-empty string separator")
+    return separator
+
+
+def _iter_mapped_lines(file_name):
+    try:
+        file_object = open(file_name, "rb")
+    except OSError:
+        raise CarlaeEvaluationError(f"Error: cannot read file {file_name}")
+    with file_object:
+        try:
+            mapped = mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be memory-mapped
+            return
+        with mapped:
+            for line in iter(mapped.readline, b""):
+                try:
+                    yield line.decode().rstrip("\r\n")
+                except UnicodeDecodeError:
+                    raise CarlaeEvaluationError(f"Error: {file_name} is not UTF-8 text")
+
+
+def _read_lines(args):
+    """
+    Takes a file name. Returns a Stream of the lines of the file (without line endings), read
+    lazily from a memory-mapped view of the file. The file is only opened once the stream is read.
+    """
+    if len(args) != 1:
+        raise CarlaeEvaluationError("Error: read-lines takes only one argument")
+    file_name = args[0]
+    if not isinstance(file_name, str):
+        raise CarlaeEvaluationError("Error: read-lines expects a file name")
+    return Stream(lambda: _iter_mapped_lines(file_name))
+
+
+def _parse_numbers(args):
+    """
+    Takes a string and an optional separator (whitespace by default). Returns a list of the
+    numbers in the string.
+
+    >>> _reduce([sum, _parse_numbers(['1,2.5,3', ',']), 0])
+    6.5
+    >>> _parse_numbers(['1 x 3'])
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeEvaluationError: Error: parse-numbers found a value that is not a number
+    >>> _parse_numbers(['1 2', ''])
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeEvaluationError: Error: parse-numbers expects a non-empty string separator
+    """
+    if len(args) not in (1, 2):
+        raise CarlaeEvaluationError("Error: incorrect number of arguments")
+    separator = _check_separator(args, "parse-numbers")
+    if not isinstance(args[0], str):
+        raise CarlaeEvaluationError("Error: parse-numbers expects a string")
+    numbers = [number_or_symbol(field) for field in args[0].split(*separator)]
+    if any(isinstance(n, str) for n in numbers):
+        raise CarlaeEvaluationError("Error: parse-numbers found a value that is not a number")
+    return _linked_list(numbers)
+
+
+def _read_records(args):
+    """
+    Takes a file name and an optional separator (whitespace by default). Returns a Stream with one
+    list per non-blank line of the file, whose elements are the line's fields converted to numbers
+    where possible.
+    """
+    if len(args) not in (1, 2):
+        raise CarlaeEvaluationError("Error: incorrect number of arguments")
+    separator = _check_separator(args, "read-records")
+    lines = _read_lines(args[:1])
+    return Stream(lambda: (
+        _linked_list([number_or_symbol(field) for field in line.split(*separator)])
+        for line in lines if line.strip()
+    ))
+
+
+def _format_value(value):
+    if isinstance(value, (Pair, Nil)):
+        fields = list(_iterate(value))
+        if any(isinstance(field, (Pair, Nil)) for field in fields):
+            raise CarlaeEvaluationError("Error: nested lists cannot be written")
+        return " ".join(_format_value(field) for field in fields)
+    if value is True:
+        return "@t"
+    if value is False:
+        return "@f"
+    if isinstance(value, (int, float, str)):
+        return str(value)
+    raise CarlaeEvaluationError("Error: only numbers, booleans, strings and lists can be written")
+
+
+def _write_lines(args):
+    """
+    Takes a file name and a list or Stream. Writes each element to the file on its own line as it
+    is produced (lists are written as space-separated fields, so nil is an empty line; nested lists
+    are rejected). The elements of a list are all checked before the file is opened. Returns the
+    number of lines written.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> with open(os.path.join(directory, 'in.txt'), 'w') as f:
+    ...     _ = f.write('1 2 3\\n\\n4 5 6\\n')
+    >>> env = make_global_env()
+    >>> evaluate(parse(tokenize('(write-lines "' + os.path.join(directory, 'out.txt') + '" '
+    ...     '(map (function (r) (reduce + r 0)) (read-records "' + os.path.join(directory, 'in.txt') + '")))')), env)
+    2
+    >>> print(open(os.path.join(directory, 'out.txt')).read(), end='')
+    6
+    15
+    >>> _write_lines([os.path.join(directory, 'out.txt'), _list([_list([1, _list([2, 3])])])])
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeEvaluationError: Error: nested lists cannot be written
+    >>> print(open(os.path.join(directory, 'out.txt')).read(), end='')
+    6
+    15
+    """
+    if len(args) != 2:
+        raise CarlaeEvaluationError("Error: incorrect number of arguments")
+    file_name, seq = args[0], args[1]
+    if isinstance(seq, Stream):
+        lines = (_format_value(value) for value in seq)
+    elif isinstance(seq, (Pair, Nil)):
+        lines = [_format_value(value) for value in _iterate(seq)]
+    else:
+        raise CarlaeEvaluationError("Error: expected a list or a stream")
+
+    count = 0
+    try:
+        file_object = open(file_name, "w")
+    except (OSError, TypeError):
+        raise CarlaeEvaluationError(f"Error: cannot write file {file_name}")
+    with file_object:
+        for line in lines:
+            line += "\n"
+            try:
+                file_object.write(line)
+            except OSError:
+                raise CarlaeEvaluationError(f"Error: cannot write file {file_name}")
+            count += 1
+    return count
+
+
+def _to_list(args):
+    """
+    Takes a Stream (or a list). Returns a linked list of its elements.
+    """
+    if len(args) != 1:
+        raise CarlaeEvaluationError("Error: to-list takes only one argument")
+    return _linked_list(list(_iterate(args[0])))
+
+
+class Stream:
+    """
+    Stream class, a lazy sequence of values (such as the lines of a file) that is consumed one
+    element at a time instead of being built into a linked list. It stores a function that makes
+    a new iterator, so every pass over the stream starts again from the beginning (re-reading a
+    file, or re-applying the functions given to map and filter).
+
+    >>> import os, tempfile
+    >>> file_name = os.path.join(tempfile.mkdtemp(), 'numbers.txt')
+    >>> with open(file_name, 'w') as f:
+    ...     _ = f.write('1,2\\n3,4\\n')
+    >>> env = make_global_env()
+    >>> _ = evaluate(parse(tokenize('(:= s (read-records "' + file_name + '" ","))')), env)
+    >>> total = parse(tokenize('(reduce + (map (function (r) (reduce + r 0)) s) 0)'))
+    >>> evaluate(total, env), evaluate(total, env)
+    (10, 10)
+    >>> evaluate(parse(tokenize('(length (to-list (filter (function (r) (> (head r) 2)) s)))')), env)
+    1
+    >>> with open(file_name, 'wb') as f:
+    ...     _ = f.write('caf\\xe9\\n'.encode('latin-1'))
+    >>> evaluate(parse(tokenize('(to-list (read-lines "' + file_name + '"))')), env)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeEvaluationError: Error: ... is not UTF-8 text
+    """
+    def __init__(self, make_iterator):
+        self.make_iterator = make_iterator
+
+
+    def __iter__(self):
+        return iter(self.make_iterator())
+
+
 class Nil:
     def __eq__(self, other):
         if isinstance(other, Nil):
@@ -489,36 +1005,45 @@ class Nil:
         return False
 
 
-def _make_builtins_env():
-    builtins = {
-        "+": sum,
-        "-": lambda args: -args[0] if len(args) == 1 else (args[0] - sum(args[1:])),
-        "*": _mul,
-        "/": _div,
-        "@t": True,
-        "@f": False,
-        "not": _not,
-        "=?": lambda args: _compare("=?", args),
-        ">": lambda args: _compare(">", args),
-        ">=": lambda args: _compare(">=", args),
-        "<": lambda args: _compare("<", args),
-        "<=": lambda args: _compare("<=", args),
-        "head": _get_head,
-        "tail": _get_tail,
-        "nil": Nil(),
-        "pair": _pair,
-        "list": _list,
-        "list?": _is_list,
-        "length": _list_length,
-        "nth": _index_list,
-        "concat": _concat_list,
-        "map": _map,
-        "filter": _filter,
-        "reduce": _reduce,
-        "begin": _begin,
+_BUILTINS = {
+    "+": sum,
+    "-": lambda args: -args[0] if len(args) == 1 else (args[0] - sum(args[1:])),
+    "*": _mul,
+    "/": _div,
+    "@t": True,
+    "@f": False,
+    "not": _not,
+    "=?": lambda args: _compare("=?", args),
+    ">": lambda args: _compare(">", args),
+    ">=": lambda args: _compare(">=", args),
+    "<": lambda args: _compare("<", args),
+    "<=": lambda args: _compare("<=", args),
+    "head": _get_head,
+    "tail": _get_tail,
+    "nil": Nil(),
+    "pair": _pair,
+    "list": _list,
+    "list?": _is_list,
+    "length": _list_length,
+    "nth": _index_list,
+    "concat": _concat_list,
+    "map": _map,
+    "filter": _filter,
+    "reduce": _reduce,
+    "begin": _begin,
+    "read-lines": _read_lines,
+    "read-records": _read_records,
+    "parse-numbers": _parse_numbers,
+    "write-lines": _write_lines,
+    "to-list": _to_list,
+
+}
 
-    }
-    return Environment(local=builtins)
+
+def _make_builtins_env():
+    # every builtins environment shares the same function objects, so snapshots can refer to them
+    # by name and tell which builtins were changed with set!
+    return Environment(local=dict(_BUILTINS))
 
 
 def make_global_env():
@@ -536,16 +1061,27 @@ class Function:
         self.params = params
         self.expr = expr
         self.environ = environ
+        # worked out on the first call, since many closures are made and never called
+        self.shadowed = None
+        self.params_checked = False
 
 
     def __call__(self, args):
         if len(self.params) != len(args):
             raise CarlaeEvaluationError("Error: parameter-argument number mismatch")
         # make a new environment whose parent is the function's enclosing environment (this is called lexical scoping).
-        frame_environ = Environment(parent=self.environ)
+        shadowed = self.shadowed
+        if shadowed is None:
+            shadowed, self.params_checked = _frame_shadowed(self.environ, self.expr, self.params, self.expr)
+            self.shadowed = shadowed
+        frame_environ = Environment(parent=self.environ, shadowed=shadowed)
         # in that new environment, bind the function's parameters to the arguments that are passed to it.
-        for p, arg in zip(self.params, args):
-            frame_environ.set_variable(p, arg)
+        if self.params_checked:
+            # the parameter names were already validated along with the frame's names
+            frame_environ.local.update(zip(self.params, args))
+        else:
+            for p, arg in zip(self.params, args):
+                frame_environ.set_variable(p, arg)
         # evaluate the body of the function in that new environment.
         result = evaluate(self.expr, frame_environ)
         return result
@@ -565,6 +1101,23 @@ class Pair:
         return False
 
 
+    def __reduce__(self):
+        # pickle a whole chain as a flat list of heads so long lists do not hit the recursion limit
+        heads = []
+        pair = self
+        while isinstance(pair, Pair):
+            heads.append(pair.head)
+            pair = pair.tail
+        return _rebuild_pairs, (heads, pair)
+
+
+def _rebuild_pairs(heads, last_tail):
+    new_list = last_tail
+    for head in reversed(heads):
+        new_list = Pair(head, new_list)
+    return new_list
+
+
 
 
 ##############
@@ -626,17 +1179,15 @@ def evaluate(tree, env=None):
         elif op == "del":
             if len(args) != 1:
                 raise CarlaeEvaluationError("Error: there should only be one variable")
-            var = args[0]
-            if var not in env.local:
-                raise CarlaeNameError("Var is not bound in the current environment")
-            return env.local.pop(var)
+            return env.del_variable(args[0])
         
         # Creates local variable definitions, which are only available in the body of the "let" expression
         elif op == "let":
             if len(args) != 2:
                 raise CarlaeEvaluationError("Error: wrong number of arguments")
             vars_vals, body = args[0], args[1]
-            local_env = Environment(parent = env)
+            shadowed, _ = _frame_shadowed(env, tree, vars_vals, body)
+            local_env = Environment(parent = env, shadowed = shadowed)
             for var_val in vars_vals:
                 var, val = var_val[0], evaluate(var_val[1], env)
                 local_env.set_variable(var, val)
@@ -664,18 +1215,26 @@ def evaluate(tree, env=None):
                 func = evaluate(op, env)
             else:
                 # Named function
-                func = env.get_variable(op)
+                func = _CALL_SITE_CACHE.lookup(tree, op, env)
             args = [evaluate(arg, env) for arg in args]
             return func(args)
 
-    # Case 2: bare value
+    # Case 2: variable
+    elif type(tree) is str:
+        variable_value = env.get_variable(tree)
+        return variable_value
+
+    # Case 3: bare value
     elif type(tree) == int or type(tree) == float:
         return tree
 
-    # Case 3: variable
+    # Case 4: string literal
+    elif type(tree) is StringLiteral:
+        return tree.value
+
+    # anything else is not a valid expression
     else:
-        variable_value = env.get_variable(tree)
-        return variable_value
+        return env.get_variable(tree)
 
 
 
@@ -693,6 +1252,143 @@ def result_and_env(tree, env=None):
     return result, env
     
 
+SNAPSHOT_VERSION = 4
+
+
+def _builtins_environment(env):
+    """
+    Walks up the parent chain of the given environment and returns the outermost one, which holds
+    the built-in functions.
+    """
+    while env.parent is not None:
+        env = env.parent
+    return env
+
+
+class _SnapshotPickler(pickle.Pickler):
+    """
+    Pickler that refers to the builtins environment and the built-in functions by name instead of
+    serializing them, since they are recreated by _make_builtins_env when the snapshot is loaded.
+    """
+    def __init__(self, file, builtins_env):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.builtins_env = builtins_env
+        self.builtin_names = {
+            id(value): name for name, value in _BUILTINS.items() if callable(value)
+        }
+
+
+    def persistent_id(self, obj):
+        if obj is self.builtins_env:
+            return ("builtins",)
+        if callable(obj) and id(obj) in self.builtin_names:
+            return ("builtin", self.builtin_names[id(obj)])
+        return None
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """
+    Unpickler that resolves the names written by _SnapshotPickler against a fresh builtins
+    environment and the original built-in functions.
+    """
+    def __init__(self, file, builtins_env):
+        super().__init__(file)
+        self.builtins_env = builtins_env
+
+
+    def persistent_load(self, pid):
+        if pid == ("builtins",):
+            return self.builtins_env
+        if pid[0] == "builtin" and pid[1] in _BUILTINS:
+            return _BUILTINS[pid[1]]
+        raise CarlaeEvaluationError(f"Error: unknown builtin {pid!r} in snapshot")
+
+
+def save_snapshot(env, file_name):
+    """
+    Takes an environment (typically one made by make_global_env and populated by evaluating a
+    prelude) and a file name. Writes the environment, including user-defined functions, their
+    enclosing environments and lists, to the file so it can be restored with load_snapshot.
+    Built-in functions are stored by name rather than serialized; builtins changed with set! or
+    deleted are saved as such. Lists are stored as separate copies, so two lists that shared a
+    tail no longer share it once restored. The file is only replaced once the whole snapshot has
+    been written. Raises a CarlaeEvaluationError if the environment holds a value that cannot be
+    saved (such as a stream), leaving any previous snapshot in place.
+
+    >>> import os, tempfile
+    >>> env = make_global_env()
+    >>> _ = evaluate(parse(tokenize('(:= (square x) (* x x))')), env)
+    >>> _ = env.set_variable('big', _rebuild_pairs(list(range(20_000)), Nil()))
+    >>> file_name = os.path.join(tempfile.mkdtemp(), 'prelude.snapshot')
+    >>> save_snapshot(env, file_name)
+    >>> restored = load_snapshot(file_name)
+    >>> evaluate(parse(tokenize('(square 7)')), restored)
+    49
+    >>> evaluate(parse(tokenize('(nth big 19999)')), restored)
+    19999
+    >>> restored.parent.get_variable('+') is sum
+    True
+
+    >>> _ = evaluate(parse(tokenize('(set! head (function (l) 999))')), env)
+    >>> save_snapshot(env, file_name)
+    >>> evaluate(parse(tokenize('(head (list 1))')), load_snapshot(file_name))
+    999
+    >>> _ = evaluate(parse(tokenize('(:= lines (read-lines "prelude.txt"))')), env)
+    >>> save_snapshot(env, file_name)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    lab.CarlaeEvaluationError: Error: environment cannot be saved: ...
+    >>> evaluate(parse(tokenize('(square 8)')), load_snapshot(file_name))
+    64
+    """
+    builtins_env = _builtins_environment(env)
+    missing = object()
+    changed = {
+        name: value for name, value in builtins_env.local.items()
+        if _BUILTINS.get(name, missing) is not value
+    }
+    deleted = [name for name in _BUILTINS if name not in builtins_env.local]
+
+    # write next to the target and swap it in, so a failed save keeps the previous snapshot
+    directory = os.path.dirname(os.path.abspath(file_name))
+    handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as file_object:
+            pickler = _SnapshotPickler(file_object, builtins_env)
+            pickler.dump((SNAPSHOT_VERSION, env, changed, deleted))
+        os.replace(temp_name, file_name)
+    except (pickle.PicklingError, TypeError, AttributeError, RecursionError) as e:
+        os.remove(temp_name)
+        raise CarlaeEvaluationError(f"Error: environment cannot be saved: {e}")
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def load_snapshot(file_name):
+    """
+    Takes a file name written by save_snapshot. Returns the saved environment, attached to a fresh
+    builtins environment, without re-evaluating any of the code that originally populated it.
+    Snapshots are pickles, so only load files that you wrote yourself. Raises a
+    CarlaeEvaluationError if the file is not a snapshot, is corrupt or has another version.
+    """
+    builtins_env = _make_builtins_env()
+    with open(file_name, "rb") as file_object:
+        try:
+            snapshot = _SnapshotUnpickler(file_object, builtins_env).load()
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError,
+                KeyError, TypeError, ValueError) as e:
+            raise CarlaeEvaluationError(f"Error: {file_name} is not a valid snapshot: {e!r}")
+    if not (isinstance(snapshot, tuple) and len(snapshot) == 4 and snapshot[0] == SNAPSHOT_VERSION):
+        raise CarlaeEvaluationError(f"Error: {file_name} is not a version {SNAPSHOT_VERSION} snapshot")
+
+    _, env, changed, deleted = snapshot
+    builtins_env.local.update(changed)
+    for name in deleted:
+        del builtins_env.local[name]
+    return env
+
+
 def REPL(env):
     while True:
         source = input("in> ")